@@ -1,8 +1,8 @@
 #!/usr/bin/env python3
-import json
 import os
 import sys
-from collections import defaultdict
+
+from jsonio import dump_json, load_json
 
 def build_key_name_registry(input_file, output_file):
     """
@@ -10,35 +10,32 @@ def build_key_name_registry(input_file, output_file):
     where key names (labels) map to keycodes
     """
     try:
-        with open(input_file, 'r') as f:
-            key_registry = json.load(f)
+        key_registry = load_json(input_file)
         
-        # Create the new dictionary with key names as keys and keycodes as values
+        # Create the new dictionary with key names as keys and keycodes as
+        # values in a single pass: store the keycode directly and promote to
+        # a list only on a second occurrence (e.g. multiple shift keys)
         name_registry = {}
-        duplicate_check = defaultdict(list)
-        
         for keycode, data in key_registry.items():
             key_name = data.get('label', '')
-            if key_name:
-                # Check for duplicates (e.g., multiple shift keys)
-                duplicate_check[key_name].append(keycode)
-                
-        # Handle duplicates by creating lists of keycodes where needed
-        for key_name, keycodes in duplicate_check.items():
-            if len(keycodes) == 1:
-                name_registry[key_name] = keycodes[0]
+            if not key_name:
+                continue
+            prev = name_registry.get(key_name)
+            if prev is None:
+                name_registry[key_name] = keycode
+            elif isinstance(prev, list):
+                prev.append(keycode)
             else:
-                name_registry[key_name] = keycodes
+                name_registry[key_name] = [prev, keycode]
         
         # Write the new JSON file
-        with open(output_file, 'w') as f:
-            json.dump(name_registry, f, indent=2)
+        dump_json(output_file, name_registry)
         
         print(f"Created key name registry at {output_file}")
         print(f"Mapped {len(name_registry)} key names")
         
-        # Report duplicates
-        duplicates = {k: v for k, v in duplicate_check.items() if len(v) > 1}
+        # Report duplicates (any name that got promoted to a list)
+        duplicates = {k: v for k, v in name_registry.items() if isinstance(v, list)}
         if duplicates:
             print(f"Found {len(duplicates)} duplicate key names:")
             for name, codes in duplicates.items():
@@ -1,30 +1,56 @@
-import json
 import re
 from pathlib import Path
 
+import numpy as np
 from bs4 import BeautifulSoup
 
+from jsonio import dump_json, load_json
+
+# Prefer lxml – its streaming iterparse keeps peak memory at O(depth)
+# instead of materializing the whole DOM, and the C parser is roughly an
+# order of magnitude faster than the pure-Python html.parser.
+try:
+    from lxml import etree
+    PARSER = "lxml"
+except ImportError:
+    etree = None
+    PARSER = "html.parser"
+
 # One keyboard "unit" is 19.05 mm (standard Cherry MX spacing)
 UNIT_MM = 19.05
 
 
+def _iter_key_elements(html_path: Path):
+    """Yield (elem, rect) for every element carrying a `data-key-id` attribute.
+
+    With lxml installed this streams the document SAX-style, clearing each
+    processed subtree so peak memory stays constant; otherwise it falls back
+    to a full BeautifulSoup parse.
+    """
+    if etree is not None:
+        for _, elem in etree.iterparse(str(html_path), events=("end",), html=True):
+            if elem.get("data-key-id") is not None:
+                yield elem, elem.find(".//rect")
+                elem.clear(keep_tail=True)
+        return
+
+    with open(html_path, "r", encoding="utf-8") as f:
+        soup = BeautifulSoup(f, PARSER)
+    for elem in soup.select("[data-key-id]"):
+        yield elem, elem.select_one("rect")
+
+
 def parse_key_layout(html_path: Path) -> dict[str, dict]:
     """Parse Yuzu's key_layout.html and return registry mapping.
 
     The returned dict maps key_id -> metadata with x/y (units), width/height (units),
     and human-readable label.
     """
-    with open(html_path, "r", encoding="utf-8") as f:
-        soup = BeautifulSoup(f, "html.parser")
-
-    # First pass: gather raw key info to compute min x/y.
+    # First pass: gather raw key info.
     raw: list[tuple[str, float, float, float, float, str | None]] = []
-    min_x = float("inf")
-    min_y = float("inf")
 
-    # Elements representing keys have a `data-key-id` attribute.
-    for elem in soup.find_all(attrs={"data-key-id": True}):
-        key_id: str = elem["data-key-id"]
+    for elem, rect in _iter_key_elements(html_path):
+        key_id: str = elem.get("data-key-id")
         try:
             x_u = float(elem.get("data-key-x", 0))
             y_u = float(elem.get("data-key-y", 0))
@@ -32,47 +58,46 @@ def parse_key_layout(html_path: Path) -> dict[str, dict]:
             x_u = float(re.findall(r"-?\d+\.\d+|-?\d+", elem.get("data-key-x", "0"))[0])
             y_u = float(re.findall(r"-?\d+\.\d+|-?\d+", elem.get("data-key-y", "0"))[0])
 
-        # Track min for normalization later
-        min_x = min(min_x, x_u)
-        min_y = min(min_y, y_u)
-
         label = elem.get("data-key-labelid")
 
-        rect = elem.find("rect")
         if rect is None:
             continue
-        width_mm = float(rect["width"])
-        height_mm = float(rect["height"])
+        width_mm = float(rect.get("width"))
+        height_mm = float(rect.get("height"))
 
         width_u = round(width_mm / UNIT_MM, 4)
         height_u = round(height_mm / UNIT_MM, 4)
 
         raw.append((key_id, x_u, y_u, width_u, height_u, label))
 
-    # Second pass: build normalized registry
-    registry: dict[str, dict] = {}
+    if not raw:
+        return {}
 
-    for key_id, x_u, y_u, width_u, height_u, label in raw:
-        # Offset so that top-left key starts at (0,0)
-        norm_x = x_u - min_x
-        norm_y = y_u - min_y
+    # Second pass: normalize every coordinate in one vectorized sweep –
+    # offset so that the top-left key starts at (0,0), then derive the
+    # right/bottom edges, all as (K, 2) array ops instead of per-key floats.
+    coords = np.array([(x, y, w, h) for _, x, y, w, h, _ in raw], dtype=np.float64)
+    norm = coords[:, :2] - coords[:, :2].min(axis=0)
+    right_bottom = (norm + coords[:, 2:]).round(4)
+    norm = norm.round(4)
 
-        entry = {
+    return {
+        key_id: {
             "label": label,
             "x_u": x_u,
             "y_u": y_u,
             "width_u": width_u,
             "height_u": height_u,
             # Normalized (0,0) origin for imaging purposes
-            "left_u": round(norm_x, 4),
-            "top_u": round(norm_y, 4),
-            "right_u": round(norm_x + width_u, 4),
-            "bottom_u": round(norm_y + height_u, 4),
+            "left_u": left,
+            "top_u": top,
+            "right_u": right,
+            "bottom_u": bottom,
         }
-
-        registry[key_id] = entry
-
-    return registry
+        for (key_id, x_u, y_u, width_u, height_u, label), (left, top), (right, bottom) in zip(
+            raw, norm.tolist(), right_bottom.tolist()
+        )
+    }
 
 
 def validate_against_sample(registry: dict[str, dict], sample_json_path: Path) -> None:
@@ -81,8 +106,7 @@ def validate_against_sample(registry: dict[str, dict], sample_json_path: Path) -
         print("[warn] sample_json.json not found – skipping validation.")
         return
 
-    with open(sample_json_path, "r", encoding="utf-8") as f:
-        sample = json.load(f)
+    sample = load_json(sample_json_path)
 
     referenced_ids = set()
     for section in ("customizedColor", "customizedTemplate", "customizedContent"):
@@ -110,8 +134,7 @@ def main() -> None:
     registry = parse_key_layout(html_path)
 
     # Write registry JSON (sorted for stable diffs)
-    with open(output_path, "w", encoding="utf-8") as f:
-        json.dump(registry, f, indent=2, sort_keys=True)
+    dump_json(output_path, registry, sort_keys=True)
 
     print(f"Saved {len(registry)} key positions to {output_path.relative_to(base_dir)}")
 
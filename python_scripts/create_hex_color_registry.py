@@ -1,11 +1,10 @@
 #!/usr/bin/env python3
-import json
 import os
 import sys
 
-def rgb_to_hex(rgb):
-    """Convert an RGB list to a hex string (without # prefix)"""
-    return '#{:02x}{:02x}{:02x}'.format(rgb[0], rgb[1], rgb[2])
+import numpy as np
+
+from jsonio import dump_json, load_json
 
 def create_hex_color_registry(input_file, output_file):
     """
@@ -13,20 +12,21 @@ def create_hex_color_registry(input_file, output_file):
     hex color codes as keys and color names as values
     """
     try:
-        with open(input_file, 'r') as f:
-            color_registry = json.load(f)
+        color_registry = load_json(input_file)
         
-        # Create the new dictionary with hex colors as keys
+        # Create the new dictionary with hex colors as keys. Pack every RGB
+        # triple into a 24-bit int in one vectorized pass, then format each
+        # with a single 06x field instead of three 02x formats per color.
+        items = [(code, data['rgb']) for code, data in color_registry.items()
+                 if len(data.get('rgb', [])) == 3]
         hex_registry = {}
-        for color_code, data in color_registry.items():
-            rgb = data.get('rgb', [])
-            if len(rgb) == 3:
-                hex_code = rgb_to_hex(rgb)
-                hex_registry[hex_code] = color_code
+        if items:
+            arr = np.array([rgb for _, rgb in items], dtype=np.uint32)
+            packed = (arr[:, 0] << 16) | (arr[:, 1] << 8) | arr[:, 2]
+            hex_registry = {f'#{v:06x}': code for (code, _), v in zip(items, packed.tolist())}
         
         # Write the new JSON file
-        with open(output_file, 'w') as f:
-            json.dump(hex_registry, f, indent=2)
+        dump_json(output_file, hex_registry)
         
         print(f"Created hex color registry at {output_file}")
         print(f"Converted {len(hex_registry)} colors")
@@ -24,39 +24,93 @@ from __future__ import annotations
 
 import argparse
 import re
+import shutil
 import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from urllib.parse import urljoin
 
 import requests
+from requests.adapters import HTTPAdapter
+
+from jsonio import dump_json, load_json
 
 
 DEFAULT_BASE = "https://yuzukeycaps.com"
 
+# Each download is dominated by network RTT, so overlap them across threads.
+MAX_WORKERS = 16
+
+PREVIEW_RE = re.compile(r'href="(/preview/[^"\s]+)"')
+
 
 def find_preview_urls(svg_text: str) -> set[str]:
     """Return unique `/preview/*.webp` href paths in *svg_text*."""
-    pattern = re.compile(r'href="(/preview/[^"\s]+)"')
-    return set(match.group(1) for match in pattern.finditer(svg_text))
+    return set(match.group(1) for match in PREVIEW_RE.finditer(svg_text))
 
 
 def download_assets(url_paths: set[str], base_url: str, dest_dir: Path) -> None:
     dest_dir.mkdir(parents=True, exist_ok=True)
     session = requests.Session()
-    for rel_path in sorted(url_paths):
+    # One shared session reuses TCP connections across worker threads.
+    adapter = HTTPAdapter(pool_connections=MAX_WORKERS * 2, pool_maxsize=MAX_WORKERS * 2)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+
+    # Validators from previous runs ({filename: {etag, last_modified}}) let
+    # us revalidate existing files with a conditional GET: a changed upstream
+    # asset is re-fetched, an unchanged one costs a zero-body 304.
+    meta_path = dest_dir / ".http_meta.json"
+    meta: dict[str, dict] = load_json(meta_path) if meta_path.exists() else {}
+    meta_lock = threading.Lock()
+
+    def fetch(rel_path: str) -> None:
         filename = Path(rel_path).name  # e.g. kam-white.webp
         dest_file = dest_dir / filename
+
+        headers = {}
         if dest_file.exists():
-            print(f"✓ {filename} already present, skipping")
-            continue
+            cached = meta.get(filename, {})
+            if cached.get("etag"):
+                headers["If-None-Match"] = cached["etag"]
+            if cached.get("last_modified"):
+                headers["If-Modified-Since"] = cached["last_modified"]
+            if not headers:
+                # No validators recorded – keep the old behaviour of trusting
+                # the local copy rather than re-downloading everything.
+                print(f"✓ {filename} already present, skipping")
+                return
+
         full_url = urljoin(base_url, rel_path)
         print(f"⇣ Downloading {full_url} -> {dest_file}")
-        resp = session.get(full_url, timeout=20)
-        if resp.status_code != 200:
-            print(f"  !! HTTP {resp.status_code} for {full_url}", file=sys.stderr)
-            continue
-        dest_file.write_bytes(resp.content)
-        print(f"  saved {len(resp.content):,} bytes")
+        # Stream straight to disk so we never hold a whole asset in memory.
+        with session.get(full_url, stream=True, timeout=20, headers=headers) as resp:
+            if resp.status_code == 304:
+                print(f"✓ {filename} unchanged upstream (304)")
+                return
+            if resp.status_code != 200:
+                print(f"  !! HTTP {resp.status_code} for {full_url}", file=sys.stderr)
+                return
+            # Write to a temp name then rename so interrupted runs never leave
+            # half-written files that the exists() check would later skip.
+            tmp_file = dest_file.with_suffix(dest_file.suffix + ".tmp")
+            with open(tmp_file, "wb") as f:
+                shutil.copyfileobj(resp.raw, f, length=1 << 16)
+            validators = {
+                "etag": resp.headers.get("ETag"),
+                "last_modified": resp.headers.get("Last-Modified"),
+            }
+        size = tmp_file.stat().st_size
+        tmp_file.rename(dest_file)
+        with meta_lock:
+            meta[filename] = validators
+        print(f"  saved {size:,} bytes")
+
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        list(executor.map(fetch, sorted(url_paths)))
+
+    dump_json(meta_path, meta)
 
 
 def main() -> None:
@@ -1,6 +1,9 @@
 import os
 import re
+import shutil
 import requests
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 
@@ -8,6 +11,9 @@ from pathlib import Path
 HTML_FILE = Path(__file__).resolve().parent.parent / "yuzu" / "sample_colors.html"
 OUTPUT_DIR = Path(__file__).resolve().parent.parent / "yuzu" / "keycaps"
 
+# Regex to capture img src URLs (compiled once at import)
+IMG_RE = re.compile(r'<img[^>]+src="([^"]+)"')
+
 # Ensure output directory exists
 OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
 
@@ -15,26 +21,40 @@ OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
 with open(HTML_FILE, "r", encoding="utf-8", errors="ignore") as f:
     html = f.read()
 
-# Regex to capture img src URLs
-img_urls = re.findall(r'<img[^>]+src="([^"]+)"', html)
+img_urls = IMG_RE.findall(html)
 print(f"Found {len(img_urls)} <img> tags.")
 
 unique_urls = sorted(set(img_urls))
 print(f"Unique image URLs: {len(unique_urls)}")
 
-for url in unique_urls:
+# Downloads are network-bound; a shared session (pooled TCP connections)
+# plus a thread pool overlaps the per-request round-trips.
+MAX_WORKERS = 16
+
+session = requests.Session()
+adapter = HTTPAdapter(pool_connections=MAX_WORKERS * 2, pool_maxsize=MAX_WORKERS * 2)
+session.mount("https://", adapter)
+session.mount("http://", adapter)
+
+
+def download(url: str) -> None:
     filename = url.split("/")[-1].split("?")[0]  # remove query params if any
     output_path = OUTPUT_DIR / filename
 
     if output_path.exists():
         print(f"[skip] {filename} already exists")
-        continue
+        return
 
     try:
-        resp = requests.get(url, timeout=30)
-        resp.raise_for_status()
-        with open(output_path, "wb") as out_file:
-            out_file.write(resp.content)
+        # Stream straight to disk instead of buffering the body in memory.
+        with session.get(url, stream=True, timeout=30) as resp:
+            resp.raise_for_status()
+            with open(output_path, "wb") as out_file:
+                shutil.copyfileobj(resp.raw, out_file, length=1 << 16)
         print(f"[done] {filename}")
     except Exception as e:
-        print(f"[error] Failed to download {url}: {e}") 
\ No newline at end of file
+        print(f"[error] Failed to download {url}: {e}")
+
+
+with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+    list(executor.map(download, unique_urls)) 
\ No newline at end of file
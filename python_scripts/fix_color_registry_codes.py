@@ -21,10 +21,11 @@ $ uv run scripts/fix_color_registry_codes.py --out yuzu/mappings/color_registry_
 from __future__ import annotations
 
 import argparse
-import json
 import re
 from pathlib import Path
 
+from jsonio import dump_json, load_json
+
 ROOT = Path(__file__).resolve().parent.parent
 REGISTRY_PATH = ROOT / "yuzu" / "mappings" / "color_registry.json"
 
@@ -68,8 +69,7 @@ def main() -> None:  # noqa: D401
     parser.add_argument("--dry-run", action="store_true", help="Print remappings without writing file")
     args = parser.parse_args()
 
-    with open(REGISTRY_PATH, "r", encoding="utf-8") as f:
-        registry: dict[str, dict] = json.load(f)
+    registry: dict[str, dict] = load_json(REGISTRY_PATH)
 
     remapped: dict[str, dict] = {}
     changed: list[tuple[str, str]] = []
@@ -92,8 +92,13 @@ def main() -> None:  # noqa: D401
         print("Dry-run complete; no file written.")
         return
 
-    with open(args.out, "w", encoding="utf-8") as f_out:
-        json.dump(remapped, f_out, indent=2, sort_keys=True)
+    # Steady state: nothing was renamed, so overwriting the registry would
+    # only churn bytes and mtimes (and invalidate CI caches).
+    if not changed and args.out == REGISTRY_PATH:
+        print("[ok] registry already canonical – nothing to write.")
+        return
+
+    dump_json(args.out, remapped, sort_keys=True)
 
     if args.out == REGISTRY_PATH:
         print(f"[ok] registry overwritten – {len(changed)} codes padded.")
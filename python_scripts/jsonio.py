@@ -0,0 +1,34 @@
+"""Shared JSON I/O helpers for the registry scripts.
+
+orjson parses and serializes several times faster than stdlib json, and its
+2-space pretty-printer runs in a single C pass instead of per-key Python
+string work. Every helper falls back to the stdlib transparently when orjson
+isn't installed, so the scripts keep working in a bare environment.
+"""
+from __future__ import annotations
+
+import json
+from pathlib import Path
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def load_json(path):
+    """Parse and return the JSON document at *path*."""
+    data = Path(path).read_bytes()
+    return orjson.loads(data) if orjson is not None else json.loads(data)
+
+
+def dump_json(path, obj, *, sort_keys: bool = False) -> None:
+    """Write *obj* to *path* as 2-space-indented JSON."""
+    if orjson is not None:
+        option = orjson.OPT_INDENT_2
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        Path(path).write_bytes(orjson.dumps(obj, option=option))
+    else:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(obj, f, indent=2, sort_keys=sort_keys, ensure_ascii=False)
@@ -1,7 +1,12 @@
 import argparse
-from pathlib import Path
-from PIL import Image, ImageOps
+import hashlib
+import mmap
 import os  # Import os for path operations
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from pathlib import Path
+from PIL import Image, ImageOps, features
+
+from jsonio import dump_json, load_json
 
 # --- Constants -------------------------------------------------------------
 # Get the workspace root assuming the script is in python_scripts/
@@ -13,74 +18,179 @@ SIZE_THRESHOLD_KB = 800
 
 
 # --- Helpers ---------------------------------------------------------------
+# The per-file work is a three-stage pipeline: decode → resize → encode. Each
+# stage is its own function so a worker's save() of one file overlaps another
+# worker's open() in the executor — Pillow releases the GIL inside its C
+# codecs, so even the thread executor pipelines the stages across files.
 
-def optimise_image(src_path: Path, dest_dir: Path, max_width: int) -> None:
-    """Resize *and* optimise a single image file.
+def file_key(src_path: Path, file_size: int, mtime_ns: int) -> str:
+    """Change-detection key: size, mtime and a hash of the first 64 KB.
 
-    The resulting file uses the same filename & extension, written to *dest_dir*.
-    Only processes if the image is larger than SIZE_THRESHOLD_KB *and* wider
-    than *max_width*. Otherwise, skips the file.
+    The partial hash catches same-size in-place edits that a bare
+    size+mtime signature could miss (e.g. files restored from backup).
     """
-    if src_path.suffix.lower() not in ALLOWED_EXTS:
-        print(f"[SKIP] Unsupported extension: {src_path.name}")
-        return
+    with open(src_path, "rb") as f:
+        digest = hashlib.blake2b(f.read(65536), digest_size=8).hexdigest()
+    return f"{file_size}-{mtime_ns}-{digest}"
 
-    dest_dir.mkdir(parents=True, exist_ok=True)
-    dest_path = dest_dir / src_path.name
 
+def _load(src_path: Path, max_width: int) -> tuple[Image.Image, str, tuple[int, int]]:
+    """Decode *src_path* and honour EXIF orientation.
+
+    Returns (image, original_mode, src_size); original_mode is the
+    pre-transpose mode, used later to decide whether a mode conversion forces
+    a re-save, and src_size is the full post-orientation source size — if the
+    returned image is smaller, draft already downscaled it and the result
+    must be saved even when no further resize happens.
+    """
+    # Memory-map the file and hand the mapping to Pillow directly (mmap
+    # objects are file-like): the page cache satisfies the codec's reads
+    # zero-copy instead of per-chunk read() syscalls.
+    fd = os.open(src_path, os.O_RDONLY)
     try:
-        file_size = src_path.stat().st_size
-    except FileNotFoundError:
-        print(f"[ERROR] File not found: {src_path}")
-        return
+        mm = mmap.mmap(fd, 0, access=mmap.ACCESS_READ)
+    finally:
+        os.close(fd)  # the mapping holds its own reference
+    try:
+        im = Image.open(mm)
+        # Orientation tags 5-8 transpose width and height, so size decisions
+        # must use the post-orientation ("effective") dimensions: drafting
+        # against the file's raw width would reduce a rotated portrait shot
+        # far past the target.
+        orientation = im.getexif().get(0x0112, 1)
+        if orientation in (5, 6, 7, 8):
+            src_size = (im.height, im.width)
+        else:
+            src_size = im.size
+        # For oversized JPEGs, draft decodes at a DCT-domain reduced scale
+        # (1/2, 1/4, 1/8) so the IDCT never touches full resolution; no-op
+        # for PNG/WebP. Only engage when we'd downscale >=2x anyway; draft
+        # never goes below the requested size, so the result lands at or
+        # above the target width. The request is made in the file's own
+        # pre-transpose coordinates (both axes scaled uniformly).
+        if im.format == "JPEG" and src_size[0] > max_width * 2:
+            im.draft(
+                "RGB",
+                (max_width * im.width // src_size[0],
+                 max_width * im.height // src_size[0]),
+            )
+        im.load()  # decodes the whole frame; nothing reads the mapping after
+        original_mode = im.mode
+        # in_place rotates the one decoded buffer; the default would allocate
+        # a second full frame even for images with no orientation tag.
+        ImageOps.exif_transpose(im, in_place=True)
+        return im, original_mode, src_size
+    finally:
+        mm.close()
 
-    with Image.open(src_path) as im:
-        im_copy = im.copy() # Keep original metadata by working on a copy initially
 
-    im_copy = ImageOps.exif_transpose(im_copy)  # honour EXIF orientation
-    orig_w, orig_h = im_copy.size
+def _resize(im: Image.Image, max_width: int) -> Image.Image:
+    """Downscale *im* to *max_width* if it is wider.
 
-    # Skip if already optimized (size and width below thresholds)
-    size_kb = file_size / 1024
-    if size_kb < SIZE_THRESHOLD_KB and orig_w <= max_width:
-        print(
-            f"[SKIP]   Already optimized: {src_path.name} "
-            f"({size_kb:.0f} KB, {orig_w}px)"
-        )
-        return
-
-    im_to_save = im_copy # Use the potentially orientation-corrected image
-
-    # Resize if necessary
-    resized = False
-    if orig_w > max_width:
-        new_h = int(orig_h * max_width / orig_w)
-        im_to_save = im_to_save.resize((max_width, new_h), Image.LANCZOS)
-        print(f"[RESIZE] {src_path.name}: {orig_w}→{max_width}px ({size_kb:.0f} KB)")
-        resized = True
-    else:
-        print(f"[RETAIN] {src_path.name}: width {orig_w}px ({size_kb:.0f} KB)")
+    thumbnail rather than resize: for big downscales it first box-reduces to
+    within reducing_gap (3x) of the target so the Lanczos convolution runs
+    on ~9x fewer pixels, and it reuses the buffer in place. The effectively
+    unbounded height keeps width the only constraint, matching the old maths.
+    """
+    if im.width > max_width:
+        im.thumbnail((max_width, 10**9), Image.LANCZOS, reducing_gap=3.0)
+    return im
 
 
-    # Choose save params based on format
+def _save(im: Image.Image, dest_path: Path, downscaled: bool, original_mode: str,
+          transcoded: bool = False) -> bool:
+    """Encode *im* to *dest_path* when anything actually changed.
+
+    Returns True if a file was written.
+    """
     suffix = dest_path.suffix.lower()
     save_kwargs = {"optimize": True}
 
-    if suffix in {".jpg", ".jpeg", ".webp"}:
+    if suffix in {".jpg", ".jpeg"}:
         save_kwargs["quality"] = 85  # good quality/size trade-off
+        # Progressive scans typically shave a few percent off the file and
+        # let browsers render incrementally; 4:2:0 chroma subsampling is the
+        # standard web trade-off at this quality. (The web_high qtables
+        # preset was tried too, but it overrides the quality=85 tables with
+        # higher-fidelity ones and grew files by ~70%.)
+        save_kwargs["progressive"] = True
+        save_kwargs["subsampling"] = 2
+    elif suffix == ".webp":
+        save_kwargs["quality"] = 82
+        save_kwargs["method"] = 6  # libwebp's slowest/best-compressing effort
+    elif suffix == ".avif":
+        save_kwargs["quality"] = 82
 
     # Ensure RGB for formats that don't support alpha
-    if suffix in {".jpg", ".jpeg", ".webp"} and im_to_save.mode in {"RGBA", "P"}:
-        im_to_save = im_to_save.convert("RGB")
+    if suffix in {".jpg", ".jpeg", ".webp"} and im.mode in {"RGBA", "P"}:
+        if im.mode == "P":
+            # Palette expansion is a pure table lookup; there's no quantisation
+            # happening in this direction, so dithering is wasted work.
+            im = im.convert("RGB", dither=Image.NONE)
+        elif im.getextrema()[3] == (255, 255):
+            # Fully opaque RGBA: just drop the alpha channel instead of
+            # running the alpha-composite conversion path.
+            im = Image.merge("RGB", im.split()[:3])
+        else:
+            im = im.convert("RGB")
 
-    # Only save if we actually resized or if the format needed conversion/optimization pass
+    # Only save if we actually downscaled (by resize or draft) or if the format needed conversion/optimization pass
     # This avoids unnecessary writes if the image was only skipped due to size/width but needed no changes
-    if resized or (im_to_save.mode != im.mode) or (suffix not in {".jpg", ".jpeg", ".webp"}): # Save PNGs too for optimize=True
+    if downscaled or transcoded or (im.mode != original_mode) or (suffix not in {".jpg", ".jpeg", ".webp"}): # Save PNGs too for optimize=True
         # Let Pillow infer the format from the file extension to avoid KeyError
-        im_to_save.save(dest_path, **save_kwargs)
+        im.save(dest_path, **save_kwargs)
+        return True
+    return False
+
+
+def optimise_image(src_path: Path, dest_dir: Path, max_width: int, file_size: int,
+                   target_format: str = "keep") -> None:
+    """Resize *and* optimise a single image file.
+
+    The resulting file uses the same filename, written to *dest_dir* — with
+    the same extension for target_format="keep", otherwise transcoded to the
+    requested format. Only processes if the image is larger than
+    SIZE_THRESHOLD_KB *and* wider than *max_width*. Otherwise, skips the
+    file. *file_size* comes from the directory scan in main() so no file is
+    stat'ed twice. main() has already created *dest_dir*.
+    """
+    if target_format == "keep":
+        dest_path = dest_dir / src_path.name
+    else:
+        dest_path = dest_dir / f"{src_path.stem}.{target_format}"
+    transcoded = dest_path.suffix.lower() != src_path.suffix.lower()
+
+    # Skip if already optimized (size and width below thresholds). Image.open
+    # only parses headers (the SOF marker for JPEG) until pixels are actually
+    # requested, so this probe costs no decode work. EXIF orientation could
+    # swap width/height, but the thresholds are generous enough not to care.
+    # A pending format conversion always has to run regardless of size.
+    size_kb = file_size / 1024
+    if size_kb < SIZE_THRESHOLD_KB and not transcoded:
+        with Image.open(src_path) as probe:
+            probe_w = probe.width
+        if probe_w <= max_width:
+            print(
+                f"[SKIP]   Already optimized: {src_path.name} "
+                f"({size_kb:.0f} KB, {probe_w}px)"
+            )
+            return
+
+    im_to_save, original_mode, src_size = _load(src_path, max_width)
+
+    im_to_save = _resize(im_to_save, max_width)
+    # Draft may already have landed on the target width, so compare against
+    # the true source size: a draft-only downscale still has to be written.
+    downscaled = im_to_save.size != src_size
+    if downscaled:
+        print(f"[RESIZE] {src_path.name}: {src_size[0]}→{im_to_save.width}px ({size_kb:.0f} KB)")
+    else:
+        print(f"[RETAIN] {src_path.name}: width {src_size[0]}px ({size_kb:.0f} KB)")
+
+    if _save(im_to_save, dest_path, downscaled, original_mode, transcoded):
         new_size_kb = dest_path.stat().st_size / 1024
         print(f"[SAVE]   → {dest_path.relative_to(WORKSPACE_ROOT)} ({new_size_kb:.0f} KB)")
-    elif not resized:
+    elif not downscaled:
          print(f"[SKIP]   No changes needed for {src_path.name}")
 
 
@@ -91,8 +201,31 @@ def main() -> None:
     parser.add_argument("--source", type=Path, default=DEFAULT_SOURCE, help="Source images directory")
     parser.add_argument("--dest", type=Path, default=DEFAULT_DEST, help="Destination directory")
     parser.add_argument("--max-width", type=int, default=1000, help="Maximum width in pixels")
+    parser.add_argument(
+        "--target-format",
+        choices=("keep", "webp", "avif"),
+        default="keep",
+        help="Output format: webp/avif are typically 25-35%% smaller than JPEG "
+             "at the same quality; 'keep' preserves the source extension",
+    )
+    parser.add_argument("--workers", type=int, default=None, help="Worker count (default: CPU count)")
+    parser.add_argument(
+        "--executor",
+        choices=("process", "thread"),
+        default="process",
+        help="Worker type: processes scale best; threads are lighter and still "
+             "overlap I/O since Pillow releases the GIL in its C codecs",
+    )
     args = parser.parse_args()
 
+    if args.target_format == "avif":
+        # Pillow only writes AVIF through the plugin codec.
+        try:
+            import pillow_avif  # noqa: F401
+        except ImportError:
+            parser.error("AVIF output requires pillow-avif-plugin "
+                         "(pip install pillow-avif-plugin)")
+
     # Ensure paths are absolute for consistency
     source_dir = args.source.resolve()
     dest_dir = args.dest.resolve()
@@ -101,20 +234,66 @@ def main() -> None:
         # Use exists() for flexibility, is_dir() ensures it's a directory
         parser.error(f"Source directory does not exist or is not a directory: {source_dir}")
 
+    # The whole pipeline is bounded by JPEG decode/encode and the resize
+    # convolution; make a slow scalar Pillow build visible rather than silent.
+    if not features.check_feature("libjpeg_turbo"):
+        print("[WARN]  Pillow is not built against libjpeg-turbo; JPEG I/O will be "
+              "slower (see requirements.txt for the pillow-simd install path)")
+
     print(f"Source: {source_dir.relative_to(WORKSPACE_ROOT)}")
     print(f"Dest:   {dest_dir.relative_to(WORKSPACE_ROOT)}")
     print(f"Max W:  {args.max_width}px, Size Threshold: {SIZE_THRESHOLD_KB}KB")
     print("-" * 20)
 
-    total = 0
-    for file_path in source_dir.iterdir():
-         if file_path.is_file() and file_path.suffix.lower() in ALLOWED_EXTS:
-            total += 1
+    # scandir DirEntry objects carry name/is_file/stat from the directory read
+    # itself, so the listing and both filters cost no extra stat round-trips.
+    with os.scandir(source_dir) as it:
+        files = [
+            (Path(entry.path), entry.stat().st_size, entry.stat().st_mtime_ns)
+            for entry in it
+            if entry.is_file(follow_symlinks=False)
+            and os.path.splitext(entry.name)[1].lower() in ALLOWED_EXTS
+        ]
+    total = len(files)
+
+    # Create the destination once here rather than once per worker call.
+    dest_dir.mkdir(parents=True, exist_ok=True)
+
+    # Manifest of already-processed sources ({src_name: key}): a file whose
+    # key matches and whose output still exists costs nothing on re-runs.
+    manifest_path = dest_dir / ".optimized.json"
+    manifest: dict[str, str] = load_json(manifest_path) if manifest_path.exists() else {}
+
+    todo: list[tuple[Path, int, str]] = []
+    for p, size, mtime_ns in files:
+        key = file_key(p, size, mtime_ns)
+        dest_name = p.name if args.target_format == "keep" else f"{p.stem}.{args.target_format}"
+        if manifest.get(p.name) == key and (dest_dir / dest_name).exists():
+            print(f"[SKIP]   Unchanged since last run: {p.name}")
+            continue
+        todo.append((p, size, key))
+
+    # Decode + resize + encode is CPU-bound and independent per file, so fan
+    # the work out across workers.
+    executor_cls = ProcessPoolExecutor if args.executor == "process" else ThreadPoolExecutor
+    with executor_cls(max_workers=args.workers or os.cpu_count()) as executor:
+        # Pass resolved absolute paths
+        futures = {
+            executor.submit(optimise_image, p, dest_dir, args.max_width, size,
+                            args.target_format): (p, key)
+            for p, size, key in todo
+        }
+        for future in as_completed(futures):
+            p, key = futures[future]
             try:
-                 # Pass resolved absolute paths
-                 optimise_image(file_path, dest_dir, args.max_width)
+                future.result()
             except Exception as e:
-                 print(f"[ERROR] Processing {file_path.name}: {e}")
+                print(f"[ERROR] Processing {p.name}: {e}")
+            else:
+                manifest[p.name] = key
+
+    if todo:
+        dump_json(manifest_path, manifest, sort_keys=True)
 
     print("-" * 20)
     print(f"\nChecked {total} image file(s) in the source directory.")
@@ -1,46 +1,114 @@
+import asyncio
 import base64
+import itertools
+import json
 import re
 from pathlib import Path
 import argparse
 import io
 
 from PIL import Image
-from openai import OpenAI
+from openai import AsyncOpenAI, RateLimitError
 import dotenv
 import os
 
 dotenv.load_dotenv()
 
-client = OpenAI(
+client = AsyncOpenAI(
     api_key=os.getenv("openai_api_key"),
     organization=os.getenv("openai_organization_id"),
 )
 
+# GPT-4o accepts many images per request; batching shares the prompt tokens
+# and collapses per-image network round-trips into one.
+BATCH_SIZE = 20
 
-def extract_code(image: Image.Image) -> str | None:
-    """Return alphanumeric keycap code via OCR, trying multiple configs."""        
-    buffer = io.BytesIO()
-    image.save(buffer, format="JPEG")
-    base64_image = base64.b64encode(buffer.getvalue()).decode("utf-8")
-    completion = client.chat.completions.create(
-        model="gpt-4o",
-        messages=[
-            {"role": "system", "content": "You are a helpful assistant that extracts alphanumeric keycap codes from images."},
-            {
-                "role": "user",
-                "content": [
-                    { "type": "text", "text": "The following image shows a keycap from a keyboard with a code printed on it. Read the code and return it as a string. Do not say anything else. Image: " },
-                    {
-                        "type": "image_url",
-                        "image_url": {
-                            "url": f"data:image/jpeg;base64,{base64_image}",
-                        },
-                    },
+# The work is bound by OpenAI latency, so overlap batches; the semaphore keeps
+# us inside the account's requests-per-minute budget.
+MAX_CONCURRENT_REQUESTS = 20
+MAX_RETRIES = 5
+
+# Unprocessed scrapes are either all-digit names or 172*-prefixed timestamps.
+UNPROCESSED_RE = re.compile(r"^(?:\d+$|172)")
+
+
+def _image_part(img_path: Path) -> dict:
+    # A keycap code needs nowhere near full resolution: shrink to <=512px and
+    # request low-detail processing, which bills a flat 85 vision tokens per
+    # image instead of >=765 for tiled high detail. Image.open only parses
+    # headers here, so a file that is already small ships its on-disk JPEG
+    # bytes untouched — no decode/re-encode generation loss or CPU.
+    with Image.open(img_path) as image:
+        if image.width <= 512 and image.height <= 512:
+            raw = img_path.read_bytes()
+        else:
+            image.thumbnail((512, 512), Image.LANCZOS)
+            buffer = io.BytesIO()
+            image.save(buffer, format="JPEG", quality=75, optimize=True)
+            raw = buffer.getvalue()
+    base64_image = base64.b64encode(raw).decode("utf-8")
+    return {
+        "type": "image_url",
+        "image_url": {
+            "url": f"data:image/jpeg;base64,{base64_image}",
+            "detail": "low",
+        },
+    }
+
+
+async def extract_codes(paths: list[Path]) -> list[str | None]:
+    """OCR a batch of keycap images in a single GPT-4o call.
+
+    Returns one code (or None) per input image, in order. The model replies
+    with a JSON array of {"i": index, "code": ...} objects which are mapped
+    back onto the batch by index. Retries with exponential backoff when the
+    API rate-limits us.
+    """
+    content: list[dict] = [
+        {
+            "type": "text",
+            "text": (
+                "Each of the following images shows a keycap from a keyboard with an "
+                "alphanumeric code printed on it. Read every code and reply with only a "
+                'JSON array of objects like [{"i": 0, "code": "ABC123"}, ...], one per '
+                "image, in input order. Do not say anything else."
+            ),
+        }
+    ]
+    for i, img_path in enumerate(paths):
+        content.append({"type": "text", "text": f"Image {i}:"})
+        content.append(_image_part(img_path))
+
+    for attempt in range(MAX_RETRIES):
+        try:
+            completion = await client.chat.completions.create(
+                model="gpt-4o",
+                messages=[
+                    {"role": "system", "content": "You are a helpful assistant that extracts alphanumeric keycap codes from images."},
+                    {"role": "user", "content": content},
                 ],
-            }
-        ],
-    )
-    return completion.choices[0].message.content.strip().upper()
+            )
+            break
+        except RateLimitError:
+            if attempt == MAX_RETRIES - 1:
+                raise
+            delay = min(2 ** attempt, 30)
+            print(f"[warn] Rate limited; retrying in {delay}s")
+            await asyncio.sleep(delay)
+
+    codes: list[str | None] = [None] * len(paths)
+    text = completion.choices[0].message.content
+    try:
+        # Tolerate markdown fences or chatter around the array.
+        payload = json.loads(text[text.index("[") : text.rindex("]") + 1])
+        for item in payload:
+            idx = item.get("i")
+            code = item.get("code")
+            if isinstance(idx, int) and 0 <= idx < len(paths) and code:
+                codes[idx] = str(code).strip().upper()
+    except (ValueError, AttributeError, TypeError) as e:
+        print(f"[warn] Could not parse batch OCR response: {e}")
+    return codes
 
 
 def main():
@@ -50,37 +118,79 @@ def main():
 
     keycaps_dir = Path(__file__).resolve().parent.parent / "yuzu" / "keycaps"
 
-    # Get all numeric-named images to process
-    images = [img for img in sorted(keycaps_dir.glob("*.jpg")) 
-              if img.stem.isdigit() or img.stem.startswith("172")]
-    
+    # Get all numeric-named images to process; one compiled-regex match per
+    # name instead of two Python-level string-method calls.
+    images = [img for img in sorted(keycaps_dir.glob("*.jpg")) if UNPROCESSED_RE.match(img.stem)]
+
+
     if args.limit is not None:
         images = images[: args.limit]
 
     print(f"Found {len(images)} numeric-named images to process")
 
-    for img_path in images:
-        try:
-            img = Image.open(img_path)
-        except Exception as e:
-            print(f"[skip] Could not open {img_path.name}: {e}")
-            continue
-
-        code = extract_code(img)
-        if code is None:
-            print(f"[warn] No code detected in {img_path.name}")
-            continue
+    if not images:
+        # Nothing to OCR — and on a fresh checkout the keycaps directory may
+        # not even exist for the rename loop's scan.
+        return
+
+    asyncio.run(process_images(keycaps_dir, images))
+
+
+async def process_images(keycaps_dir: Path, images: list[Path]) -> None:
+    """OCR all batches concurrently, then apply renames batch by batch."""
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+
+    async def bounded(batch_paths: list[Path]) -> list[str | None]:
+        async with semaphore:
+            return await extract_codes(batch_paths)
+
+    # Probe each file's header up front so unreadable images are skipped with
+    # a message instead of failing a whole batch mid-flight.
+    batches: list[list[Path]] = []
+    for batch in itertools.batched(images, BATCH_SIZE):
+        valid: list[Path] = []
+        for img_path in batch:
+            try:
+                with Image.open(img_path):
+                    pass
+            except Exception as e:
+                print(f"[skip] Could not open {img_path.name}: {e}")
+                continue
+            valid.append(img_path)
+        if valid:
+            batches.append(valid)
+
+    # return_exceptions so one batch that exhausts its retries (or hits a
+    # non-rate-limit API error) doesn't throw away the paid OCR results of
+    # every batch that already completed.
+    results = await asyncio.gather(
+        *(bounded(batch) for batch in batches), return_exceptions=True
+    )
 
-        new_filename = f"{code}.jpg"
-        new_path = img_path.with_name(new_filename)
+    # One directory scan up front replaces a per-file exists() stat, and the
+    # set tracks our own renames so duplicate handling stays deterministic.
+    existing = {entry.name for entry in os.scandir(keycaps_dir)}
 
-        if not new_path.exists():
-            print(f"[rename] {img_path.name} -> {new_filename}")
-            img_path.rename(new_path)
-        else:
-            if img_path != new_path:
+    for batch, codes in zip(batches, results):
+        if isinstance(codes, BaseException):
+            print(f"[warn] Batch starting at {batch[0].name} failed: {codes}")
+            continue
+        for img_path, code in zip(batch, codes):
+            if code is None:
+                print(f"[warn] No code detected in {img_path.name}")
+                continue
+
+            new_filename = f"{code}.jpg"
+
+            if new_filename not in existing:
+                print(f"[rename] {img_path.name} -> {new_filename}")
+                img_path.rename(img_path.with_name(new_filename))
+                existing.add(new_filename)
+                existing.discard(img_path.name)
+            elif img_path.name != new_filename:
                 print(f"[cleanup] Removing duplicate {img_path.name} (already have {new_filename})")
                 img_path.unlink()
+                existing.discard(img_path.name)
 
 
 if __name__ == "__main__":